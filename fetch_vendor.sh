@@ -0,0 +1,34 @@
+#!/bin/sh
+# Vendor the Socket.IO client so the landing page doesn't depend on a third-party CDN.
+# Keep the version in sync with SOCKETIO_CLIENT_CDN_URL in main.py, and commit the
+# downloaded static/vendor/socket.io.min.js.
+set -e
+SOCKETIO_VERSION=4.7.5
+# sha256 of socket.io.min.js for SOCKETIO_VERSION. Until it is pinned the script
+# prints the downloaded file's hash and refuses to install it.
+SOCKETIO_SHA256=""
+
+cd "$(dirname "$0")"
+tmp="$(mktemp)"
+trap 'rm -f "$tmp"' EXIT
+curl -fsSL "https://cdn.socket.io/${SOCKETIO_VERSION}/socket.io.min.js" -o "$tmp"
+actual="$(sha256sum "$tmp" | cut -d' ' -f1)"
+
+sri="sha384-$(openssl dgst -sha384 -binary "$tmp" | openssl base64 -A)"
+
+if [ -z "$SOCKETIO_SHA256" ]; then
+    echo "SOCKETIO_SHA256 is not pinned. Verify and pin this hash, then re-run:" >&2
+    echo "  $actual" >&2
+    echo "SRI hash for CMDI_SOCKETIO_CDN_INTEGRITY (CDN fallback):" >&2
+    echo "  $sri" >&2
+    exit 1
+fi
+if [ "$actual" != "$SOCKETIO_SHA256" ]; then
+    echo "Checksum mismatch for socket.io.min.js: expected $SOCKETIO_SHA256, got $actual" >&2
+    exit 1
+fi
+
+mkdir -p static/vendor
+mv "$tmp" static/vendor/socket.io.min.js
+trap - EXIT
+echo "Installed static/vendor/socket.io.min.js (socket.io ${SOCKETIO_VERSION}, ${sri})"
@@ -1,26 +1,41 @@
 from __future__ import annotations
 
+import gzip
+import hashlib
+import json
 import math
+import mimetypes
+import os
 import random
 import time
 import uuid
-from dataclasses import dataclass
+import dataclasses
+from dataclasses import asdict, dataclass
 from threading import Lock
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO
+from flask import Flask, Response, abort, render_template, request
+from flask_socketio import ConnectionRefusedError, SocketIO
+from markupsafe import Markup, escape
 
 import requests
 import docker
 import urllib.parse
 import secrets
 import socket
+import sys
 from docker import errors as docker_errors
+from docker.types import Ulimit
 import atexit
 import signal
 import logging
 
+from eventlet import tpool
+
+try:
+    import brotli  # listed in requirements.txt; guarded so a missing wheel only loses .br
+except ImportError:
+    brotli = None
 
 
 
@@ -55,6 +70,75 @@ except Exception:
     client = None
 IMAGE_NAME = "ctf-ping-vuln"
 
+# Per-container resource isolation
+CPU_PERIOD_US = 100_000
+DEFAULT_RESOURCE_PROFILE = os.environ.get("CMDI_RESOURCE_PROFILE", "default")
+MONITOR_INTERVAL_SECONDS = 5
+MONITOR_DOCKER_TIMEOUT_SECONDS = 3
+# Users evicted as noisy get this profile for later sessions until the penalty expires
+NOISY_USER_PROFILE = "strict"
+NOISY_USER_PENALTY_SECONDS = 3600
+# Optional JSON file of {"name": {"cpus": ..., "pids_limit": ..., ...}} overriding
+# or adding to the built-in profiles below
+RESOURCE_PROFILES_FILE = os.environ.get("CMDI_RESOURCE_PROFILES_FILE", "")
+# A sample is "noisy" when usage sits at or above this share of the profile's limit
+NOISY_USAGE_FRACTION = 0.9
+THROTTLE_AFTER_STRIKES = 3
+EVICT_AFTER_STRIKES = 12
+
+# Static asset pipeline: these files get content-hashed, precompressed URLs
+STATIC_ASSETS = ("app.js", "vendor/socket.io.min.js")
+SOCKETIO_CLIENT_CDN_URL = "https://cdn.socket.io/4.7.5/socket.io.min.js"
+# SRI hash ("sha384-...") for the CDN fallback; fetch_vendor.sh prints it
+SOCKETIO_CLIENT_CDN_INTEGRITY = os.environ.get("CMDI_SOCKETIO_CDN_INTEGRITY", "")
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+INDEX_CACHE_CONTROL = "no-cache"
+COMPRESS_MIN_BYTES = 512
+
+# Session/queue persistence (write-ahead journal + compacted snapshot)
+STATE_DIR = os.environ.get(
+    "CMDI_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "state")
+)
+# "always" fsyncs every record, "batch" once per supervisor tick, "off" never
+STATE_JOURNAL_FSYNC = os.environ.get("CMDI_JOURNAL_FSYNC", "batch")
+# Leave containers running on shutdown so the next start can reattach to them.
+# Containers still exit on their own after CONTAINER_MAX_LIFETIME_SECONDS, so
+# nothing outlives its session if the orchestrator never comes back.
+KEEP_CONTAINERS_ON_EXIT = os.environ.get("CMDI_KEEP_CONTAINERS", "1") not in ("", "0", "false")
+CONTAINER_MAX_LIFETIME_SECONDS = SESSION_DURATION_SECONDS + 60
+STATE_JOURNAL_MAX_ENTRIES = 1000
+STATE_SNAPSHOT_INTERVAL_SECONDS = 30
+RESUME_GRACE_SECONDS = 120
+
+
+
+def _rate_from_env(name: str, default: Tuple[float, float]) -> Tuple[float, float]:
+    """Parse a "rate,burst" pair from the environment."""
+    raw = os.environ.get(name)
+    if not raw:
+        return default
+    try:
+        rate, burst = (float(part) for part in raw.split(","))
+        return rate, burst
+    except ValueError:
+        logging.warning("Ignoring malformed %s=%r; expected \"rate,burst\"", name, raw)
+        return default
+
+
+# Admission control: (tokens per second, burst capacity). Connects are keyed by
+# client IP, which a whole venue may share behind NAT, so the default is generous.
+CONNECT_RATE_PER_CLIENT = _rate_from_env("CMDI_CONNECT_RATE_PER_CLIENT", (10.0, 100))
+CONNECT_RATE_GLOBAL = _rate_from_env("CMDI_CONNECT_RATE_GLOBAL", (50.0, 200))
+# request_text is keyed by user, so this one can stay tight
+REQUEST_RATE_PER_USER = _rate_from_env("CMDI_REQUEST_RATE_PER_USER", (1.0, 3))
+REQUEST_RATE_GLOBAL = _rate_from_env("CMDI_REQUEST_RATE_GLOBAL", (20.0, 100))
+# Peers whose X-Forwarded-For we trust. Caddy runs on this host and appends
+# the real client address as the last hop; direct clients can't forge it.
+TRUSTED_PROXIES = frozenset(
+    ["127.0.0.1", "::1"]
+    + [addr.strip() for addr in os.environ.get("CMDI_TRUSTED_PROXIES", "").split(",") if addr.strip()]
+)
+
 
 # Add a new configuration for the base URL
 # BASE_URL = "https://hacker-cmdi.devvillie.me"  # Update this to the actual base URL of your server
@@ -66,6 +150,8 @@ class ActiveSession:
     text: str
     started_at: float
     expires_at: float
+    container_name: str = ""
+    resource_profile: str = ""
 
 
 @dataclass
@@ -74,6 +160,77 @@ class QueuedUser:
     sid: str
     token: str
     enqueued_at: float
+    resource_profile: str = ""
+
+
+@dataclass(frozen=True)
+class ResourceProfile:
+    cpus: float
+    cpu_shares: int
+    pids_limit: int
+    blkio_weight: Optional[int]
+    nofile: int
+    mem_limit: str = "100m"
+    mem_reservation: str = "75m"
+    # CPU ceiling applied once the monitor decides the container is noisy
+    throttled_cpus: float = 0.1
+
+    def run_kwargs(self) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {
+            "mem_limit": self.mem_limit,
+            "mem_reservation": self.mem_reservation,
+            "cpu_period": CPU_PERIOD_US,
+            "cpu_quota": int(self.cpus * CPU_PERIOD_US),
+            "cpu_shares": self.cpu_shares,
+            "pids_limit": self.pids_limit,
+            "ulimits": [Ulimit(name="nofile", soft=self.nofile, hard=self.nofile)],
+        }
+        if self.blkio_weight is not None:
+            kwargs["blkio_weight"] = self.blkio_weight
+        return kwargs
+
+
+RESOURCE_PROFILES: Dict[str, ResourceProfile] = {
+    "default": ResourceProfile(cpus=0.5, cpu_shares=512, pids_limit=64, blkio_weight=100, nofile=1024),
+    "strict": ResourceProfile(
+        cpus=0.25, cpu_shares=256, pids_limit=32, blkio_weight=50, nofile=256, throttled_cpus=0.05
+    ),
+}
+
+
+def _load_resource_profiles(path: str) -> None:
+    """Merge profiles from a JSON file; fields not given keep their built-in value."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        builtin = dict(RESOURCE_PROFILES)
+        for name, fields in overrides.items():
+            base = builtin.get(name, builtin["default"])
+            RESOURCE_PROFILES[name] = dataclasses.replace(base, **fields)
+    except (OSError, ValueError, TypeError, AttributeError):
+        logging.exception("Failed to load resource profiles from %s; using built-in profiles", path)
+
+
+if RESOURCE_PROFILES_FILE:
+    _load_resource_profiles(RESOURCE_PROFILES_FILE)
+
+
+@dataclass
+class ContainerUsage:
+    container_id: str
+    cpu_total: Optional[int] = None
+    system_total: Optional[int] = None
+    strikes: int = 0
+    throttled: bool = False
+
+
+@dataclass
+class CachedAsset:
+    body: bytes
+    mimetype: str
+    digest: str
+    gzip_body: Optional[bytes] = None
+    br_body: Optional[bytes] = None
 
 
 active_sessions: Dict[str, ActiveSession] = {}
@@ -81,6 +238,295 @@ waiting_queue: List[QueuedUser] = []
 sid_to_user: Dict[str, str] = {}
 _lock = Lock()
 _supervisor_started = False
+# Users restored from disk that have not reconnected yet: user_id -> deadline
+_unclaimed: Dict[str, float] = {}
+# Users with a request_text currently being handled; duplicates are dropped
+_pending_requests: set = set()
+# Users the resource monitor evicted -> penalty expiry; see NOISY_USER_PROFILE
+_noisy_users: Dict[str, float] = {}
+
+
+class TokenBucket:
+    """Classic token bucket; ``has_token``/``take`` never block."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def has_token(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1.0
+
+    def take(self) -> None:
+        self.tokens -= 1.0
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """Per-key token buckets in front of one shared global bucket."""
+
+    def __init__(
+        self,
+        per_key: Tuple[float, float],
+        global_: Tuple[float, float],
+        prune_interval: float = 60.0,
+    ) -> None:
+        self.per_key = per_key
+        self.global_bucket = TokenBucket(*global_)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.prune_interval = prune_interval
+        self._last_prune = time.monotonic()
+        self._lock = Lock()
+
+    def allow(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune >= self.prune_interval:
+                # Full buckets carry no state worth keeping
+                for stale in [k for k, b in self.buckets.items() if b.is_idle(now)]:
+                    del self.buckets[stale]
+                self._last_prune = now
+
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(*self.per_key, now=now)
+            # Spend only when both have a token, so a refusal costs nobody anything
+            if not (bucket.has_token(now) and self.global_bucket.has_token(now)):
+                return False
+            bucket.take()
+            self.global_bucket.take()
+            return True
+
+
+connect_limiter = RateLimiter(CONNECT_RATE_PER_CLIENT, CONNECT_RATE_GLOBAL)
+request_limiter = RateLimiter(REQUEST_RATE_PER_USER, REQUEST_RATE_GLOBAL)
+
+
+class StateJournal:
+    """Append-only journal of state changes with periodic compacted snapshots.
+
+    Every mutation of ``active_sessions``/``waiting_queue`` is appended as one
+    JSON line. Compaction writes the full state to ``snapshot.json`` atomically
+    and truncates the journal; records carry a sequence number so a crash
+    between the two steps never replays an entry twice.
+    """
+
+    def __init__(self, directory: str, fsync: str = "batch") -> None:
+        self.directory = directory
+        self.fsync = fsync
+        self._unsynced = False
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.journal_path = os.path.join(directory, "journal.log")
+        self.seq = 0
+        self.entries_since_snapshot = 0
+        self._fh = None
+
+    def open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._fh = open(self.journal_path, "a", encoding="utf-8")
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def append(self, op: str, **data: Any) -> None:
+        if self._fh is None:
+            return
+        self.seq += 1
+        record = {"seq": self.seq, "op": op, **data}
+        try:
+            self._fh.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._fh.flush()
+            if self.fsync == "always":
+                os.fsync(self._fh.fileno())
+            else:
+                self._unsynced = True
+        except OSError:
+            logging.exception("Failed to append %s record to state journal", op)
+        self.entries_since_snapshot += 1
+
+    def sync(self) -> None:
+        """Flush records appended since the last sync to disk (batch mode)."""
+        if self._fh is None or not self._unsynced or self.fsync == "off":
+            return
+        try:
+            os.fsync(self._fh.fileno())
+        except OSError:
+            logging.exception("Failed to fsync state journal")
+            return
+        self._unsynced = False
+
+    def load(self) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Return the last snapshot and the journal records written after it."""
+        snapshot: Dict[str, Any] = {"seq": 0, "active": [], "queue": []}
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            logging.exception("Ignoring unreadable state snapshot %s", self.snapshot_path)
+
+        entries: List[Dict[str, Any]] = []
+        last_seq = snapshot.get("seq", 0)
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn write can only be the tail; stop replaying here
+                        logging.warning("Ignoring truncated state journal record")
+                        break
+                    if record.get("seq", 0) > snapshot.get("seq", 0):
+                        entries.append(record)
+                        last_seq = max(last_seq, record["seq"])
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logging.exception("Failed to read state journal %s", self.journal_path)
+
+        self.seq = last_seq
+        return snapshot, entries
+
+    def compact(self, state: Dict[str, Any]) -> None:
+        if self._fh is None:
+            return
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(dict(state, seq=self.seq), f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self._fh.seek(0)
+            self._fh.truncate()
+            self._unsynced = False
+        except OSError:
+            logging.exception("Failed to compact state journal")
+            return
+        self.entries_since_snapshot = 0
+
+
+state_journal = StateJournal(STATE_DIR, fsync=STATE_JOURNAL_FSYNC)
+
+
+def _state_snapshot() -> Dict[str, Any]:
+    return {
+        "active": [asdict(session) for session in active_sessions.values()],
+        "queue": [asdict(queued) for queued in waiting_queue],
+    }
+
+
+def _journal(op: str, **data: Any) -> None:
+    """Record a state change. Caller must hold ``_lock``."""
+    state_journal.append(op, **data)
+    if state_journal.entries_since_snapshot >= STATE_JOURNAL_MAX_ENTRIES:
+        state_journal.compact(_state_snapshot())
+
+
+def _stop_container_quietly(container, context: str) -> None:
+    try:
+        container.stop(timeout=1)
+    except docker_errors.NotFound:
+        pass
+    except docker_errors.APIError as e:
+        resp = getattr(e, "response", None)
+        if not (resp is not None and getattr(resp, "status_code", None) == 404):
+            logging.exception("Docker API error while stopping %s", context)
+    except requests.exceptions.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            logging.exception("HTTP error while stopping %s", context)
+    except Exception:
+        logging.exception("Unexpected error stopping %s", context)
+
+
+def _restore_state() -> None:
+    """Rebuild sessions and queue from disk and reattach to live containers."""
+    started = time.time()
+    snapshot, entries = state_journal.load()
+
+    restored_active: Dict[str, ActiveSession] = {}
+    for data in snapshot.get("active", []):
+        restored_active[data["user_id"]] = ActiveSession(**data)
+    restored_queue: List[QueuedUser] = [QueuedUser(**data) for data in snapshot.get("queue", [])]
+
+    for record in entries:
+        op = record.get("op")
+        if op == "activate":
+            session = ActiveSession(**record["session"])
+            restored_active[session.user_id] = session
+        elif op == "end":
+            restored_active.pop(record["user_id"], None)
+        elif op == "enqueue":
+            restored_queue.append(QueuedUser(**record["queued"]))
+        elif op == "dequeue":
+            restored_queue = [q for q in restored_queue if q.user_id != record["user_id"]]
+
+    live: Dict[str, Any] = {}
+    if client is not None:
+        try:
+            for container in client.containers.list(filters={"name": "ctf_"}):
+                live[container.name] = container
+        except Exception:
+            logging.exception("Failed to list running containers for reattach")
+
+    now = time.time()
+    with _lock:
+        for session in restored_active.values():
+            container = live.pop(session.container_name, None)
+            if container is None:
+                continue
+            if session.expires_at <= now:
+                _stop_container_quietly(container, f"expired restored container {container.name}")
+                continue
+            active_sessions[session.user_id] = session
+            containers[session.user_id] = container
+            _unclaimed[session.user_id] = now + RESUME_GRACE_SECONDS
+
+        for queued in restored_queue:
+            if queued.user_id in active_sessions:
+                continue
+            waiting_queue.append(queued)
+            _unclaimed[queued.user_id] = now + RESUME_GRACE_SECONDS
+
+        # Containers we have no session for would otherwise leak
+        for container in live.values():
+            _stop_container_quietly(container, f"orphaned container {container.name}")
+
+        state_journal.open()
+        state_journal.compact(_state_snapshot())
+
+    logging.info(
+        "Restored %d active session(s) and %d queued user(s) in %.1f ms",
+        len(active_sessions),
+        len(waiting_queue),
+        (time.time() - started) * 1000,
+    )
+
+
+def _shutdown() -> None:
+    with _lock:
+        if not KEEP_CONTAINERS_ON_EXIT:
+            # Sessions can't outlive their containers; keep only the queue
+            stop_containers()
+            active_sessions.clear()
+        state_journal.compact(_state_snapshot())
+        state_journal.close()
 
 
 def _ensure_supervisor() -> None:
@@ -88,26 +534,14 @@ def _ensure_supervisor() -> None:
     with _lock:
         if not _supervisor_started:
             socketio.start_background_task(_session_supervisor)
+            socketio.start_background_task(_resource_monitor)
             _supervisor_started = True
 
 def stop_containers():
     global containers
     logging.info("Stopping all containers...")
     for container in list(containers.values()):
-        try:
-            container.stop(timeout=1)
-            logging.info("Stopped container: %s", getattr(container, "name", "?"))
-        except docker_errors.NotFound:
-            pass
-        except docker_errors.APIError as e:
-            resp = getattr(e, "response", None)
-            if not (resp is not None and getattr(resp, "status_code", None) == 404):
-                logging.exception("Docker API error stopping container %s", getattr(container, 'name', '?'))
-        except requests.exceptions.HTTPError as e:
-            if e.response is None or e.response.status_code != 404:
-                logging.exception("HTTP error stopping container %s", getattr(container, 'name', '?'))
-        except Exception:
-            logging.exception("Unexpected error while stopping container %s", getattr(container, 'name', '?'))
+        _stop_container_quietly(container, f"container {getattr(container, 'name', '?')}")
     containers.clear()
     logging.info("All containers stopped.")
 
@@ -147,12 +581,28 @@ def _find_next_free_port(start: int, end: int) -> int:
     # Fallback to start if nothing free (shouldn't happen with small pool)
     return start
 
-def generate_ping_server(user_id: str) -> str:
+def _get_resource_profile(name: str) -> ResourceProfile:
+    profile = RESOURCE_PROFILES.get(name)
+    if profile is None:
+        logging.warning("Unknown resource profile %r; using default", name)
+        profile = RESOURCE_PROFILES["default"]
+    return profile
+
+
+def _profile_for_user(user_id: str) -> str:
+    if _noisy_users.get(user_id, 0) > time.time():
+        return NOISY_USER_PROFILE
+    return DEFAULT_RESOURCE_PROFILE
+
+
+def generate_ping_server(user_id: str, profile_name: str = DEFAULT_RESOURCE_PROFILE) -> str:
     global port_now
 
     if client is None:
         raise RuntimeError("Docker is unavailable on the server.")
 
+    profile = _get_resource_profile(profile_name)
+
     secure_password = secrets.token_urlsafe(16)
     encoded_password = urllib.parse.quote(secure_password)
 
@@ -167,9 +617,10 @@ def generate_ping_server(user_id: str) -> str:
                 ports={'80/tcp': port},
                 name=f"ctf_{port}",
                 environment={"CMDI_PASSWORD": secure_password},
+                # Hard cap on lifetime, enforced inside the container itself
+                command=["timeout", str(CONTAINER_MAX_LIFETIME_SECONDS), "python", "app.py"],
                 auto_remove=True,
-                mem_limit="100m",
-                mem_reservation="75m",
+                **profile.run_kwargs(),
             )
         else:
             raise RuntimeError("Client is None")
@@ -238,9 +689,11 @@ def _activate_user(
     *,
     from_queue: bool = False,
     queue_token: Optional[str] = None,
+    profile_name: str = "",
 ) -> None:
+    profile_name = profile_name or _profile_for_user(user_id)
     try:
-        text = generate_ping_server(user_id)
+        text = generate_ping_server(user_id, profile_name)
     except Exception:
         logging.exception("Failed to start ping server for user_id=%s", user_id)
         socketio.emit(
@@ -260,8 +713,11 @@ def _activate_user(
         text=text,
         started_at=now,
         expires_at=now + SESSION_DURATION_SECONDS,
+        container_name=getattr(containers.get(user_id), "name", ""),
+        resource_profile=profile_name,
     )
     active_sessions[user_id] = session
+    _journal("activate", session=asdict(session))
     socketio.emit(
         "session_update",
         {
@@ -299,12 +755,27 @@ def _emit_queue_positions(now: Optional[float] = None) -> None:
 
 
 def _session_supervisor() -> None:
+    last_snapshot = time.time()
     while True:
         socketio.sleep(1)
         now = time.time()
         expired_users: List[str] = []
 
         with _lock:
+            for user_id, until in list(_noisy_users.items()):
+                if until <= now:
+                    _noisy_users.pop(user_id, None)
+
+            # Drop restored users that never came back after a restart
+            for user_id, deadline in list(_unclaimed.items()):
+                if deadline > now:
+                    continue
+                _unclaimed.pop(user_id, None)
+                if user_id in active_sessions:
+                    expired_users.append(user_id)
+                else:
+                    _remove_from_queue(user_id)
+
             # Update timers for active users
             for session in list(active_sessions.values()):
                 remaining = int(session.expires_at - now)
@@ -324,6 +795,7 @@ def _session_supervisor() -> None:
             for user_id in expired_users:
                 session = active_sessions.pop(user_id, None)
                 if session:
+                    _journal("end", user_id=user_id)
                     socketio.emit(
                         "session_update",
                         {
@@ -334,41 +806,177 @@ def _session_supervisor() -> None:
                         },
                         to=session.sid,
                     )
-                    if user_id in containers:
-                        try:
-                            containers[user_id].stop(timeout=1)
-                        except docker_errors.NotFound:
-                            pass
-                        except docker_errors.APIError as e:
-                            resp = getattr(e, "response", None)
-                            if not (resp is not None and getattr(resp, "status_code", None) == 404):
-                                logging.exception("Docker API error while stopping expired container for user_id=%s", user_id)
-                        except requests.exceptions.HTTPError as e:
-                            if e.response is None or e.response.status_code != 404:
-                                logging.exception("HTTP error while stopping expired container for user_id=%s", user_id)
-                        except Exception:
-                            logging.exception("Unexpected error stopping expired container for user_id=%s", user_id)
-                        finally:
-                            containers.pop(user_id, None)
-
-            # Promote queued users into open slots
-            while waiting_queue and len(active_sessions) < MAX_ACTIVE_USERS:
-                queued = waiting_queue.pop(0)
+                    container = containers.pop(user_id, None)
+                    if container is not None:
+                        _stop_container_quietly(container, f"expired container for user_id={user_id}")
+
+            # Promote queued users into open slots. Users restored after a restart
+            # keep their place but aren't started until they reconnect to claim it.
+            index = 0
+            while index < len(waiting_queue) and len(active_sessions) < MAX_ACTIVE_USERS:
+                if waiting_queue[index].user_id in _unclaimed:
+                    index += 1
+                    continue
+                queued = waiting_queue.pop(index)
+                _journal("dequeue", user_id=queued.user_id)
                 _activate_user(
                     queued.user_id,
                     queued.sid,
                     from_queue=True,
                     queue_token=queued.token,
+                    profile_name=queued.resource_profile,
                 )
 
             # Notify queued users about their latest position
             _emit_queue_positions(now)
 
+            if (
+                state_journal.entries_since_snapshot
+                and now - last_snapshot >= STATE_SNAPSHOT_INTERVAL_SECONDS
+            ):
+                state_journal.compact(_state_snapshot())
+                last_snapshot = now
+            else:
+                state_journal.sync()
+
+
+def _usage_sample(stats: Dict[str, Any], usage: ContainerUsage) -> Tuple[Optional[float], int]:
+    """Return (CPUs used since the previous sample, current PID count)."""
+    cpu_stats = stats.get("cpu_stats") or {}
+    cpu_total = (cpu_stats.get("cpu_usage") or {}).get("total_usage")
+    system_total = cpu_stats.get("system_cpu_usage")
+    online_cpus = cpu_stats.get("online_cpus") or 1
+    pids = (stats.get("pids_stats") or {}).get("current") or 0
+
+    cpus_used = None
+    if (
+        cpu_total is not None
+        and system_total is not None
+        and usage.cpu_total is not None
+        and usage.system_total is not None
+        and system_total > usage.system_total
+    ):
+        cpus_used = (cpu_total - usage.cpu_total) / (system_total - usage.system_total) * online_cpus
+    usage.cpu_total = cpu_total
+    usage.system_total = system_total
+    return cpus_used, pids
+
+
+def _evict_user(user_id: str, message: str) -> None:
+    """End a user's session and stop their container. Caller must hold ``_lock``."""
+    session = active_sessions.pop(user_id, None)
+    if session:
+        _journal("end", user_id=user_id)
+        socketio.emit(
+            "session_update",
+            {
+                "status": "ended",
+                "message": message,
+                "text": session.text,
+                "timeRemaining": 0,
+            },
+            to=session.sid,
+        )
+    container = containers.pop(user_id, None)
+    if container is not None:
+        _stop_container_quietly(container, f"evicted container for user_id={user_id}")
+
+
+def _resource_monitor() -> None:
+    """Throttle, then evict, containers that sit at their CPU or PID limits.
+
+    Docker calls run in eventlet's thread pool on a dedicated client with a
+    short timeout, so a slow daemon never stalls the hub.
+    """
+    try:
+        monitor_api = docker.from_env(timeout=MONITOR_DOCKER_TIMEOUT_SECONDS).api
+    except Exception:
+        logging.exception("Resource monitor disabled: Docker client unavailable")
+        return
+
+    usage_by_user: Dict[str, ContainerUsage] = {}
+    while True:
+        socketio.sleep(MONITOR_INTERVAL_SECONDS)
+        tracked: List[Tuple[str, Any, str]] = []
+        with _lock:
+            for user_id, container in containers.items():
+                session = active_sessions.get(user_id)
+                if session is not None:
+                    tracked.append((user_id, container, session.resource_profile))
+
+        seen = set()
+        to_evict: List[str] = []
+        for user_id, container, profile_name in tracked:
+            seen.add(user_id)
+            profile = _get_resource_profile(profile_name or DEFAULT_RESOURCE_PROFILE)
+            usage = usage_by_user.get(user_id)
+            if usage is None or usage.container_id != container.id:
+                # A container reattached after a restart may already be throttled
+                quota = (getattr(container, "attrs", None) or {}).get("HostConfig", {}).get("CpuQuota")
+                usage = usage_by_user[user_id] = ContainerUsage(
+                    container_id=container.id,
+                    throttled=quota == int(profile.throttled_cpus * CPU_PERIOD_US),
+                )
+            try:
+                # one_shot skips the daemon's second sample, so this returns immediately
+                stats = tpool.execute(monitor_api.stats, container.id, stream=False, one_shot=True)
+            except Exception:
+                logging.debug("Failed to read stats for container %s", getattr(container, "name", "?"))
+                continue
+            finally:
+                socketio.sleep(0)
+
+            cpus_used, pids = _usage_sample(stats, usage)
+            cpu_limit = profile.throttled_cpus if usage.throttled else profile.cpus
+            noisy = pids >= NOISY_USAGE_FRACTION * profile.pids_limit or (
+                cpus_used is not None and cpus_used >= NOISY_USAGE_FRACTION * cpu_limit
+            )
+            usage.strikes = usage.strikes + 1 if noisy else 0
+
+            if usage.strikes >= EVICT_AFTER_STRIKES:
+                to_evict.append(user_id)
+            elif usage.strikes >= THROTTLE_AFTER_STRIKES and not usage.throttled:
+                try:
+                    tpool.execute(
+                        monitor_api.update_container,
+                        container.id,
+                        cpu_period=CPU_PERIOD_US,
+                        cpu_quota=int(profile.throttled_cpus * CPU_PERIOD_US),
+                    )
+                    usage.throttled = True
+                    # Give the lower ceiling a full window before counting towards eviction
+                    usage.strikes = 0
+                    logging.warning(
+                        "Throttled noisy container %s (cpus=%s, pids=%d)",
+                        getattr(container, "name", "?"),
+                        f"{cpus_used:.2f}" if cpus_used is not None else "?",
+                        pids,
+                    )
+                except Exception:
+                    logging.exception("Failed to throttle container %s", getattr(container, "name", "?"))
+
+        for user_id in list(usage_by_user):
+            if user_id not in seen:
+                usage_by_user.pop(user_id, None)
+
+        if to_evict:
+            with _lock:
+                for user_id in to_evict:
+                    if user_id in active_sessions:
+                        logging.warning("Evicting noisy container for user_id=%s", user_id)
+                        _noisy_users[user_id] = time.time() + NOISY_USER_PENALTY_SECONDS
+                    _evict_user(
+                        user_id,
+                        "Session ended: your server kept exhausting its CPU or process limit.",
+                    )
+                    usage_by_user.pop(user_id, None)
+
 
 def _remove_from_queue(user_id: str) -> Optional[QueuedUser]:
     for index, queued in enumerate(waiting_queue):
         if queued.user_id == user_id:
             removed = waiting_queue.pop(index)
+            _journal("dequeue", user_id=user_id)
             return removed
     return None
 
@@ -380,6 +988,14 @@ def _get_sid() -> str:
     return sid
 
 
+def _client_key() -> str:
+    if request.remote_addr in TRUSTED_PROXIES:
+        forwarded = request.headers.get("X-Forwarded-For", "")
+        if forwarded:
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return request.remote_addr or "unknown"
+
+
 def _calculate_queue_waits(now: Optional[float] = None) -> Dict[str, int]:
     if now is None:
         now = time.time()
@@ -409,26 +1025,162 @@ def _calculate_queue_waits(now: Optional[float] = None) -> Dict[str, int]:
     return waits
 
 
+# Logical name ("app.js") -> relative URL, and hashed name -> cached body
+asset_urls: Dict[str, str] = {}
+hashed_assets: Dict[str, CachedAsset] = {}
+_index_page: Optional[CachedAsset] = None
+
+
+def _cache_asset(body: bytes, mimetype: str) -> CachedAsset:
+    digest = hashlib.sha256(body).hexdigest()[:12]
+    asset = CachedAsset(body=body, mimetype=mimetype, digest=digest)
+    if len(body) >= COMPRESS_MIN_BYTES:
+        asset.gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            asset.br_body = brotli.compress(body, quality=11)
+    return asset
+
+
+def _build_static_assets() -> None:
+    """Hash and precompress static files once so requests never touch disk."""
+    for name in STATIC_ASSETS:
+        path = os.path.join(app.static_folder or "static", name)
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            logging.error(
+                "Static asset %s is missing; serving it from %s instead. Run fetch_vendor.sh.",
+                name,
+                asset_url(name),
+            )
+            continue
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        asset = _cache_asset(body, mimetype)
+        stem, ext = os.path.splitext(name)
+        hashed_name = f"{stem}.{asset.digest}{ext}"
+        hashed_assets[hashed_name] = asset
+        asset_urls[name] = f"assets/{hashed_name}"
+
+
+@app.template_global()
+def asset_url(name: str) -> str:
+    url = asset_urls.get(name)
+    if url:
+        return url
+    if name == "vendor/socket.io.min.js":
+        return SOCKETIO_CLIENT_CDN_URL
+    return f"static/{name}"
+
+
+@app.template_global()
+def asset_attrs(name: str) -> Markup:
+    """Extra <script> attributes for assets that fall back to a third-party URL."""
+    if name != "vendor/socket.io.min.js" or name in asset_urls:
+        return Markup("")
+    attrs = ' crossorigin="anonymous"'
+    if SOCKETIO_CLIENT_CDN_INTEGRITY:
+        attrs += f' integrity="{escape(SOCKETIO_CLIENT_CDN_INTEGRITY)}"'
+    else:
+        logging.warning("Serving Socket.IO client from the CDN without an integrity hash")
+    return Markup(attrs)
+
+
+def _send_cached(asset: CachedAsset, cache_control: str) -> Response:
+    body, encoding = asset.body, None
+    if asset.br_body is not None and request.accept_encodings.quality("br"):
+        body, encoding = asset.br_body, "br"
+    elif asset.gzip_body is not None and request.accept_encodings.quality("gzip"):
+        body, encoding = asset.gzip_body, "gzip"
+
+    etag = f"{asset.digest}-{encoding or 'identity'}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=asset.mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+_build_static_assets()
+
+
 @app.route("/")
-def index() -> str:
-    return render_template("index.html")
+def index() -> Response:
+    global _index_page
+    if _index_page is None:
+        html = render_template("index.html").encode("utf-8")
+        _index_page = _cache_asset(html, "text/html")
+    # The page references hashed assets, so browsers only need to revalidate it
+    return _send_cached(_index_page, INDEX_CACHE_CONTROL)
+
+
+@app.route("/assets/<path:filename>")
+def hashed_asset(filename: str) -> Response:
+    asset = hashed_assets.get(filename)
+    if asset is None:
+        abort(404)
+    return _send_cached(asset, ASSET_CACHE_CONTROL)
+
+
+def _resume_user(user_id: str, sid: str) -> None:
+    """Bind a restored user to their new socket and replay their state."""
+    session = active_sessions.get(user_id)
+    if session:
+        session.sid = sid
+        socketio.emit(
+            "session_update",
+            {
+                "status": "active",
+                "text": session.text,
+                "timeRemaining": max(0, int(session.expires_at - time.time())),
+                "message": "Reconnected. Your ping server is still running.",
+            },
+            to=sid,
+        )
+        return
+
+    for queued in waiting_queue:
+        if queued.user_id == user_id:
+            queued.sid = sid
+            break
+    _emit_queue_positions()
 
 
 @socketio.on("connect")
-def handle_connect():
+def handle_connect(auth=None):
+    client_key = _client_key()
+    # Reject storms before touching the shared lock
+    if not connect_limiter.allow(client_key):
+        raise ConnectionRefusedError("Too many connection attempts. Please wait a moment.")
+
     _ensure_supervisor()
     sid = _get_sid()
+    resume_key = auth.get("resumeKey") if isinstance(auth, dict) else None
+    if not isinstance(resume_key, str):
+        resume_key = None
     with _lock:
-        user_id = str(uuid.uuid4())
+        resumed = bool(resume_key) and _unclaimed.pop(resume_key, None) is not None
+        user_id = resume_key if resumed else str(uuid.uuid4())
         sid_to_user[sid] = user_id
-    socketio.emit(
-        "session_update",
-        {
-            "status": "connected",
-            "message": "Connected. Click the button to request the ping server.",
-        },
-        to=sid,
-    )
+        if resume_key and not resumed and resume_key in _noisy_users:
+            # A reconnecting client keeps any noisy-container penalty it had
+            _noisy_users[user_id] = _noisy_users[resume_key]
+        socketio.emit(
+            "session_update",
+            {
+                "status": "connected",
+                "message": "Connected. Click the button to request the ping server.",
+                "resumeKey": user_id,
+            },
+            to=sid,
+        )
+        if resumed:
+            _resume_user(user_id, sid)
 
 
 @socketio.on("disconnect")
@@ -442,6 +1194,7 @@ def handle_disconnect(reason=None):
         # Remove from active sessions if present
         active = active_sessions.pop(user_id, None)
         if active:
+            _journal("end", user_id=user_id)
             socketio.emit(
                 "session_update",
                 {
@@ -451,22 +1204,9 @@ def handle_disconnect(reason=None):
                 },
                 to=active.sid,
             )
-            if user_id in containers.keys():
-                c = containers.pop(user_id, None)
-                if c:
-                    try:
-                        c.stop(timeout=1)
-                    except docker_errors.NotFound:
-                        pass
-                    except docker_errors.APIError as e:
-                        resp = getattr(e, "response", None)
-                        if not (resp is not None and getattr(resp, "status_code", None) == 404):
-                            logging.exception("Docker API error while stopping container on disconnect for user_id=%s", user_id)
-                    except requests.exceptions.HTTPError as e:
-                        if e.response is None or e.response.status_code != 404:
-                            logging.exception("HTTP error while stopping container on disconnect for user_id=%s", user_id)
-                    except Exception:
-                        logging.exception("Unexpected error stopping container on disconnect for user_id=%s", user_id)
+            c = containers.pop(user_id, None)
+            if c is not None:
+                _stop_container_quietly(c, f"container on disconnect for user_id={user_id}")
 
         # Remove from queue if present
         removed = _remove_from_queue(user_id)
@@ -487,14 +1227,33 @@ def handle_disconnect(reason=None):
 @socketio.on("request_text")
 def handle_request_text():
     sid = _get_sid()
+    # Cheap checks first: these reads don't need the lock
+    user_id = sid_to_user.get(sid)
+    if not user_id or user_id in _pending_requests:
+        return
+    if not request_limiter.allow(user_id):
+        socketio.emit(
+            "session_update",
+            {
+                "status": "throttled",
+                "message": "Too many requests. Please wait a moment and try again.",
+            },
+            to=sid,
+        )
+        return
+
+    _pending_requests.add(user_id)
+    try:
+        _handle_request_text(user_id, sid)
+    finally:
+        _pending_requests.discard(user_id)
+
+
+def _handle_request_text(user_id: str, sid: str) -> None:
     with _lock:
-        user_id = sid_to_user.get(sid)
-        if not user_id:
+        if sid_to_user.get(sid) != user_id:
             return
 
-        now = time.time()
-        waits_lookup = _calculate_queue_waits(now)
-
         # Already active? refresh status
         if user_id in active_sessions:
             session = active_sessions[user_id]
@@ -514,6 +1273,7 @@ def handle_request_text():
         # Already queued? send position update
         for position, queued in enumerate(waiting_queue, start=1):
             if queued.user_id == user_id:
+                waits_lookup = _calculate_queue_waits()
                 socketio.emit(
                     "session_update",
                     {
@@ -540,8 +1300,10 @@ def handle_request_text():
             sid=sid,
             token=token,
             enqueued_at=time.time(),
+            resource_profile=_profile_for_user(user_id),
         )
         waiting_queue.append(queued_user)
+        _journal("enqueue", queued=asdict(queued_user))
         now = time.time()
         waits_lookup = _calculate_queue_waits(now)
         position = len(waiting_queue)
@@ -561,11 +1323,13 @@ def handle_request_text():
 
 
 if __name__ == "__main__":
-    # Ensure cleanup on exit and signals
-    atexit.register(stop_containers)
+    # Persist state on exit and signals. Containers keep running so the next
+    # start can reattach to them, unless CMDI_KEEP_CONTAINERS=0.
+    _restore_state()
+    atexit.register(_shutdown)
     for sig in (signal.SIGINT, signal.SIGTERM):
         try:
-            signal.signal(sig, lambda s, f: stop_containers())
+            signal.signal(sig, lambda s, f: sys.exit(0))
         except Exception:
             logging.debug("Signal handler registration failed for %s", sig)
     _ensure_supervisor()
@@ -9,13 +9,35 @@ const requestBtn = document.getElementById("request-btn");
 
 const basePath = window.location.pathname.replace(/\/$/, "");
 const socketPath = basePath ? `${basePath}/socket.io` : "/socket.io";
+const RESUME_KEY_STORAGE = "cmdiResumeKey";
+
+function loadResumeKey() {
+  try {
+    return sessionStorage.getItem(RESUME_KEY_STORAGE);
+  } catch (err) {
+    return null;
+  }
+}
+
+function saveResumeKey(key) {
+  try {
+    sessionStorage.setItem(RESUME_KEY_STORAGE, key);
+  } catch (err) {
+    // Storage may be disabled; resuming after a server restart just won't work
+  }
+}
 
 const socket = io("https://hackersir-cmdi.devvillie.me", {
   path: socketPath,
   transports: ["websocket"],
+  // Lets the server hand back our slot or queue position after it restarts
+  auth: (cb) => cb({ resumeKey: loadResumeKey() }),
   reconnection: true,
   reconnectionAttempts: Infinity,
   reconnectionDelay: 1000,
+  // Back off and spread retries so an outage doesn't end in a reconnect stampede
+  reconnectionDelayMax: 15000,
+  randomizationFactor: 0.5,
 });
 
 function setStatus(state, message) {
@@ -27,6 +49,12 @@ function setStatus(state, message) {
 // Surface socket-level errors
 socket.on("connect_error", () => {
   setStatus("error", "Connection error. Retrying…");
+  if (!socket.active) {
+    // The server refused us (e.g. rate limited); the client won't retry on
+    // its own, so come back after a jittered delay.
+    const delay = 5000 + Math.random() * 10000;
+    setTimeout(() => socket.connect(), delay);
+  }
 });
 socket.on("error", () => {
   setStatus("error", "Server error. Please try again.");
@@ -85,8 +113,13 @@ socket.on("session_update", (payload = {}) => {
     queueTokenEl.textContent = "—";
     updateQueueWait(undefined);
   } else if (status === "connected") {
+    if (typeof payload.resumeKey === "string") {
+      saveResumeKey(payload.resumeKey);
+    }
     setStatus("active", message || "Connected. Click the button to ask for the ping server.");
     updateQueueWait(undefined);
+  } else if (status === "throttled") {
+    statusMessage.textContent = message || "Too many requests. Please wait.";
   } else if (status === "error") {
     setStatus("error", message || "An unexpected error occurred.");
     timerEl.textContent = "—";